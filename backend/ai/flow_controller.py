@@ -1,4 +1,7 @@
+import os
+import threading
 import uuid
+from collections import deque
 from datetime import datetime, timezone
 
 try:
@@ -7,6 +10,11 @@ except ImportError:
     from services.state_service import get_clinical_mode
 
 _sessions = {}
+_sessions_lock = threading.Lock()
+_conversation_window = int(os.getenv("CHAT_MEMORY_WINDOW", "6"))
+_summary_max_chars = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "600"))
+_summary_turn_chars = 120
+_PRIVATE_SESSION_KEYS = ("conversation", "conversationSummary")
 
 
 def _now_iso():
@@ -39,9 +47,80 @@ def _build_session_state(session_id, state=None):
         base["createdAt"] = now
     if "step" not in base:
         base["step"] = 1
+    if "conversation" not in base:
+        base["conversation"] = deque(maxlen=_conversation_window)
+        base["conversationSummary"] = ""
     return base
 
 
+def loggable_session(state):
+    # La memoria de conversación contiene texto del usuario: nunca va a los logs.
+    return {k: v for k, v in (state or {}).items() if k not in _PRIVATE_SESSION_KEYS}
+
+
+def _summarize_turn(turn):
+    content = " ".join(str(turn.get("content") or "").split())
+    for sep in (". ", "? ", "! "):
+        cut = content.find(sep)
+        if 0 < cut < _summary_turn_chars:
+            content = content[:cut + 1]
+            break
+    if len(content) > _summary_turn_chars:
+        content = content[:_summary_turn_chars - 3].rstrip() + "..."
+    prefix = "Usuario" if turn.get("role") == "user" else "Doctor"
+    return f"{prefix}: {content}"
+
+
+def _fold_into_summary(summary, turn):
+    # Resumen extractivo: la primera frase de cada turno que sale de la
+    # ventana, descartando lo más antiguo para mantener un costo fijo.
+    parts = [summary, _summarize_turn(turn)] if summary else [_summarize_turn(turn)]
+    summary = " | ".join(parts)
+    if len(summary) > _summary_max_chars:
+        summary = summary[-_summary_max_chars:]
+        cut = summary.find(" | ")
+        if cut != -1:
+            summary = summary[cut + 3:]
+    return summary
+
+
+def record_turn(session_id, role, content):
+    if not content:
+        return
+    with _sessions_lock:
+        state = _sessions.get(session_id)
+        if state is None:
+            return
+        conversation = state["conversation"]
+        if len(conversation) == conversation.maxlen:
+            state["conversationSummary"] = _fold_into_summary(state["conversationSummary"], conversation[0])
+        conversation.append({"role": role, "content": content})
+
+
+def seed_conversation(session_id, messages):
+    """Carga recentMessages de clientes antiguos solo si la sesión aún no tiene memoria."""
+    state = _sessions.get(session_id)
+    if state is None or state["conversation"] or not isinstance(messages, list):
+        return
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content") or message.get("message")
+        record_turn(session_id, message.get("role") or "user", content)
+
+
+def session_count():
+    return len(_sessions)
+
+
+def get_conversation(session_id):
+    state = _sessions.get(session_id)
+    if state is None:
+        return "", []
+    with _sessions_lock:
+        return state["conversationSummary"], list(state["conversation"])
+
+
 def create_session():
     session_id = str(uuid.uuid4())
     state = _build_session_state(session_id, {})
@@ -49,7 +128,7 @@ def create_session():
     print("FLOW_CONTROLLER CREATE_SESSION")
     print("SESSION ID:", session_id)
     print("STATE CREATED:")
-    print(state)
+    print(loggable_session(state))
     print("===================================")
     _sessions[session_id] = state
     return state
@@ -62,10 +141,10 @@ def get_session(session_id):
     print("===================================")
     print("FLOW_CONTROLLER GET_SESSION BEFORE UPDATE")
     print("SESSION ID:", session_id)
-    print("STATE:", state)
+    print("STATE:", loggable_session(state))
     state = _build_session_state(session_id, state)
     print("FLOW_CONTROLLER GET_SESSION AFTER UPDATE")
-    print("STATE:", state)
+    print("STATE:", loggable_session(state))
     print("===================================")
     _sessions[session_id] = state
     return state
@@ -82,10 +161,10 @@ def touch_session(session_id):
     print("===================================")
     print("FLOW_CONTROLLER TOUCH_SESSION BEFORE UPDATE")
     print("SESSION ID:", session_id)
-    print("STATE:", state)
+    print("STATE:", loggable_session(state))
     state = _build_session_state(session_id, state)
     print("FLOW_CONTROLLER TOUCH_SESSION AFTER UPDATE")
-    print("STATE:", state)
+    print("STATE:", loggable_session(state))
     print("===================================")
     _sessions[session_id] = state
     return state
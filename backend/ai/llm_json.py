@@ -0,0 +1,138 @@
+try:
+    from ..services.json_codec import loads
+except ImportError:
+    from services.json_codec import loads
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class JsonObjectScanner:
+    """Escanea texto (completo o por fragmentos) buscando el primer objeto JSON con "message" legible."""
+
+    def __init__(self):
+        self._reset()
+        self.parsed = None
+        self.complete = False
+
+    def _reset(self):
+        self.buffer = []
+        self.started = False
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        # Dígitos hex que faltan de un escape \uXXXX en curso.
+        self.unicode_left = 0
+        self.length = 0
+        # Posición de cada coma fuera de strings junto con la pila abierta en ese punto,
+        # para poder recortar un objeto truncado hasta el último miembro completo.
+        self.commas = []
+
+    def feed(self, chunk):
+        pending = chunk
+        while pending and not self.complete:
+            pending = self._scan(pending)
+        return self.complete
+
+    def _scan(self, chunk):
+        """Consume chunk; si cierra un bloque que no es JSON válido, devuelve el texto a re-escanear."""
+        for index, ch in enumerate(chunk):
+            if not self.started:
+                if ch != "{":
+                    continue
+                self.started = True
+            self.buffer.append(ch)
+            self.length += 1
+            if self.in_string:
+                if self.unicode_left:
+                    self.unicode_left -= 1
+                elif self.escape:
+                    self.escape = False
+                    if ch == "u":
+                        self.unicode_left = 4
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in _CLOSERS:
+                self.stack.append(ch)
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    parsed = _parse_reply(self.text())
+                    if parsed is not None:
+                        self.parsed = parsed
+                        self.complete = True
+                        return ""
+                    # Bloque balanceado que no es una respuesta ("Nota {x}: {...}",
+                    # "{}"): se sigue buscando desde la siguiente llave.
+                    retry = self.text()[1:] + chunk[index + 1:]
+                    self._reset()
+                    return retry
+            elif ch == ",":
+                self.commas.append((self.length - 1, "".join(self.stack)))
+        return ""
+
+    def text(self):
+        return "".join(self.buffer)
+
+    def _candidates(self):
+        text = self.text()
+        closers = "".join(_CLOSERS[c] for c in reversed(self.stack))
+        tail = text
+        if self.in_string:
+            if self.unicode_left:
+                tail = tail[:-(6 - self.unicode_left)]
+            elif self.escape:
+                tail = tail[:-1]
+            tail += '"'
+        tail = tail.rstrip()
+        if tail.endswith(","):
+            tail = tail[:-1]
+        if tail.endswith(":"):
+            tail += "null"
+        yield tail + closers
+        yield tail + ":null" + closers
+        for index, stack in reversed(self.commas):
+            yield text[:index] + "".join(_CLOSERS[c] for c in reversed(stack))
+
+    def result(self):
+        if self.complete:
+            return self.parsed
+        if not self.started:
+            return None
+        for candidate in self._candidates():
+            parsed = _parse_reply(candidate)
+            if parsed is not None:
+                return parsed
+        return None
+
+
+def _parse_reply(text):
+    # Solo cuenta como respuesta un objeto con "message" legible: "{}" o
+    # {"message": null} dentro de texto plano harían perder el texto original.
+    try:
+        parsed = loads(text)
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    message = parsed.get("message")
+    if not isinstance(message, str) or not message.strip():
+        return None
+    return parsed
+
+
+def extract_llm_json(content):
+    """Devuelve la primera respuesta JSON con "message" de la salida del LLM, reparando truncados; None si no hay."""
+    if not content:
+        return None
+    parsed = _parse_reply(content)
+    if parsed is not None:
+        return parsed
+    scanner = JsonObjectScanner()
+    scanner.feed(content)
+    return scanner.result()
@@ -0,0 +1,31 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+
+# La app se importa una sola vez en el master y los workers la heredan por
+# fork (copy-on-write), así cada reinicio de worker no repite el arranque.
+preload_app = True
+
+
+def when_ready(server):
+    # El estado se carga en el master antes del fork para que los workers
+    # compartan las páginas en lugar de leer el JSON cada uno por su cuenta.
+    try:
+        from backend.services.state_service import load_state
+    except ImportError:
+        from services.state_service import load_state
+    load_state()
+    server.log.info("CleanMate state preloaded before forking workers")
+
+
+def post_fork(server, worker):
+    # El pool de eventos ejecutados arranca al bootear el worker para que
+    # los eventos pendientes de un crash se apliquen sin esperar tráfico nuevo.
+    try:
+        from backend.services.executed_queue import start
+    except ImportError:
+        from services.executed_queue import start
+    start()
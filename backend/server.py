@@ -1,34 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-import requests
-import json
 import time
 from datetime import datetime
 from dotenv import load_dotenv
 import hashlib
 
 try:
-    from .services.state_service import load_state, save_state, get_clinical_mode, update_last_analysis, update_last_optimization, append_history
+    from .services.state_service import load_state, get_clinical_mode, state_store_health, update_fields
 except ImportError:
-    from services.state_service import load_state, save_state, get_clinical_mode, update_last_analysis, update_last_optimization, append_history
+    from services.state_service import load_state, get_clinical_mode, state_store_health, update_fields
+
+try:
+    from .services.executed_queue import enqueue_executed, idempotency_key_for, queue_depth, queue_stats, start as start_executed_queue
+except ImportError:
+    from services.executed_queue import enqueue_executed, idempotency_key_for, queue_depth, queue_stats, start as start_executed_queue
+
+try:
+    from .services.fleet_analysis import build_analysis_message, iter_machines, stream_batch
+except ImportError:
+    from services.fleet_analysis import build_analysis_message, iter_machines, stream_batch
+
+try:
+    from .services.rate_limiter import AdmissionRejected, admission_slot, check_rate_limit, limiter_stats
+except ImportError:
+    from services.rate_limiter import AdmissionRejected, admission_slot, check_rate_limit, limiter_stats
+
+try:
+    from .services.health import ensure_prober, health_body, readiness_report, upstream_snapshot
+except ImportError:
+    from services.health import ensure_prober, health_body, readiness_report, upstream_snapshot
+
+try:
+    from .services.json_codec import dumps, dumps_bytes, loads
+    from .services.schemas import ChatRequest, ExecutedEvent, NextAction, SchemaError, SessionState
+except ImportError:
+    from services.json_codec import dumps, dumps_bytes, loads
+    from services.schemas import ChatRequest, ExecutedEvent, NextAction, SchemaError, SessionState
 
 try:
     from .ai.agent_prompt import get_system_prompt
-    from .ai.flow_controller import create_session, get_session, touch_session
+    from .ai.flow_controller import create_session, get_conversation, get_session, loggable_session, record_turn, seed_conversation, session_count, touch_session
+    from .ai.llm_json import extract_llm_json
 except ImportError:
     from ai.agent_prompt import get_system_prompt
-    from ai.flow_controller import create_session, get_session, touch_session
+    from ai.flow_controller import create_session, get_conversation, get_session, loggable_session, record_turn, seed_conversation, session_count, touch_session
+    from ai.llm_json import extract_llm_json
 
 load_dotenv()
 
 app = Flask(__name__)
+# Render termina TLS en un proxy: el primer salto de X-Forwarded-For es el cliente.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv("PROXY_FIX_X_FOR", "1")))
 CORS(app)
-load_state()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
 GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_MODELS_URL = "https://api.groq.com/openai/v1/models"
 _last_groq_body = None
 CLOSING_INTENTS = [
     "gracias",
@@ -42,9 +72,41 @@ CLOSING_INTENTS = [
 ]
 
 
+def _request_json():
+    raw = request.get_data(cache=True)
+    if not raw:
+        return None
+    try:
+        return loads(raw)
+    except ValueError:
+        return None
+
+
+def json_response(payload):
+    return app.response_class(dumps_bytes(payload), mimetype="application/json")
+
+
+def _public_session(session_state):
+    return SessionState.from_dict(session_state).to_dict()
+
+
+def _throttled_payload(session_state, retry_after):
+    return {
+        "message": "Hay mucha demanda en este momento. Intenta de nuevo en unos segundos.",
+        "nextAction": NextAction.none().to_dict(),
+        "mode": session_state.get("mode"),
+        "sessionState": _public_session(session_state),
+        "throttled": True,
+        "retryAfter": retry_after
+    }
+
+
 def _call_groq(messages, max_tokens=400, temperature=0.3, timeout=30):
     if not GROQ_API_KEY:
         raise RuntimeError("GROQ_API_KEY no configurada")
+    # Import diferido: requests es la dependencia más pesada del arranque
+    # y solo se necesita cuando se llama a Groq.
+    import requests
     app.logger.info(f"Groq request endpoint={GROQ_URL} model={GROQ_MODEL}")
     payload = {
         "model": GROQ_MODEL,
@@ -71,7 +133,7 @@ def _call_groq(messages, max_tokens=400, temperature=0.3, timeout=30):
     app.logger.info(f"Groq response status={resp.status_code} timeMs={response_time_ms} bodyLen={body_len}")
     app.logger.info(f"Groq raw body={body_text}")
     if resp.status_code == 200:
-        data = resp.json()
+        data = loads(resp.content)
         return data
     if resp.status_code == 429:
         app.logger.warning(f"Groq 429 body={resp.text}")
@@ -84,36 +146,16 @@ def _call_groq(messages, max_tokens=400, temperature=0.3, timeout=30):
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_system():
-    data = request.json
+    data = _request_json()
     
     # Validar estructura básica de entrada
     if not data or 'system_info' not in data:
-        return jsonify({"error": "Datos inválidos"}), 400
+        return json_response({"error": "Datos inválidos"}), 400
 
     try:
         system_info = data.get('system_info', {}) or {}
         cleanup_info = data.get('cleanup_info', {}) or {}
-
-        cpu = system_info.get('cpu')
-        ram = system_info.get('ram_percent')
-        disk = system_info.get('disk_percent')
-
-        status_parts = []
-        if cpu is not None:
-            status_parts.append(f"CPU {cpu}%")
-        if ram is not None:
-            status_parts.append(f"RAM {ram}%")
-        if disk is not None:
-            status_parts.append(f"Disco {disk}%")
-        status_text = ", ".join(status_parts) if status_parts else "sin métricas claras"
-
-        freed_mb = cleanup_info.get('freed_mb')
-        files_deleted = cleanup_info.get('files_deleted')
-        cleanup_summary = ""
-        if freed_mb is not None or files_deleted is not None:
-            cleanup_summary = f" Limpieza reciente: liberados {freed_mb or 0} MB en {files_deleted or 0} elementos."
-
-        message_text = f"Estado actual: {status_text}.{cleanup_summary} Se recomienda revisar procesos en segundo plano y considerar una optimización si percibes lentitud."
+        message_text = build_analysis_message(system_info, cleanup_info)
 
         response_payload = {
             "choices": [
@@ -125,17 +167,29 @@ def analyze_system():
             ]
         }
 
-        return jsonify(response_payload), 200
+        return json_response(response_payload), 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    ndjson = "ndjson" in (request.content_type or "")
+    try:
+        if ndjson:
+            machines = iter_machines(None, stream=request.stream, ndjson=True)
+        else:
+            machines = list(iter_machines(request.get_data()))
+    except ValueError as e:
+        return json_response({"error": str(e)}), 400
+    return Response(stream_with_context(stream_batch(machines)), mimetype="application/x-ndjson")
 
 @app.route('/api/report', methods=['POST'])
 def receive_report():
     try:
-        data = request.json
+        data = _request_json()
         if not data:
-            return jsonify({"error": "No data provided"}), 400
+            return json_response({"error": "No data provided"}), 400
             
         # Log del reporte recibido (Simulación de guardado en DB)
         print(f"Reporte recibido: {data.get('type', 'unknown')} - {len(str(data))} bytes")
@@ -143,46 +197,32 @@ def receive_report():
         # Aquí se podría guardar en base de datos
         # db.save_report(data)
         
-        return jsonify({"status": "success", "message": "Report received successfully"}), 201
+        return json_response({"status": "success", "message": "Report received successfully"}), 201
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 @app.route('/api/system/executed', methods=['POST'])
 def system_executed():
-    data = request.json or {}
-    print("===========================================")
+    data = _request_json() or {}
     print("SYSTEM EXECUTED ENDPOINT HIT")
-    print("PAYLOAD:", data)
-    event_type = data.get("type")
-    report = data.get("report")
-    print("TYPE:", event_type)
-    print("REPORT:", report)
-    state_before = load_state()
-    print("STATE BEFORE UPDATE:")
-    print("LAST_ANALYSIS:", state_before.get("last_analysis"))
-    print("LAST_OPTIMIZATION:", state_before.get("last_optimization"))
-    print("CLINICAL_MODE_BEFORE:", get_clinical_mode())
-    print("===========================================")
-    if event_type not in ["analyze", "optimize"] or report is None:
-        return jsonify({"error": "Invalid payload"}), 400
-    timestamp = datetime.utcnow().isoformat() + "Z"
-    event = {
-        "type": event_type,
-        "timestamp": timestamp,
-        "summary": report
-    }
-    if event_type == "analyze":
-        update_last_analysis(timestamp, report)
-    elif event_type == "optimize":
-        update_last_optimization(timestamp, report)
-    append_history(event)
-    state_after = load_state()
-    print("STATE AFTER UPDATE (POST EXECUTION):")
-    print("LAST_ANALYSIS:", state_after.get("last_analysis"))
-    print("LAST_OPTIMIZATION:", state_after.get("last_optimization"))
-    print("CLINICAL_MODE_AFTER:", get_clinical_mode())
-    print("===========================================")
-    return jsonify({"status": "ok"}), 201
+    try:
+        executed = ExecutedEvent.from_dict(data)
+    except SchemaError:
+        return json_response({"error": "Invalid payload"}), 400
+    key = idempotency_key_for(data, request.headers.get("Idempotency-Key"))
+    enqueued = enqueue_executed(executed, key)
+    print("EXECUTED ENQUEUED:", enqueued, "KEY:", key, "DEPTH:", queue_depth())
+    return json_response({"status": "queued" if enqueued else "duplicate", "idempotencyKey": key}), 202
+
+
+@app.route('/api/system/queue', methods=['GET'])
+def system_queue():
+    """Métricas de la cola de eventos ejecutados de este worker.
+
+    La deduplicación por Idempotency-Key es por proceso: un reintento que
+    llega a otro worker de gunicorn no se detecta como duplicado.
+    """
+    return json_response(queue_stats()), 200
 
 
 def build_compact_clinical_context(state, messages):
@@ -277,6 +317,15 @@ def should_regenerate_summary(state, new_metrics) -> bool:
         return True
     return False
 
+_CHAT_STATE_FIELDS = ("clinical_mode", "confidence", "last_metrics")
+_SUMMARY_STATE_FIELDS = (
+    "compact_summary",
+    "compact_summary_hash",
+    "last_analysis_ts_snapshot",
+    "last_optimization_ts_snapshot"
+)
+
+
 def _build_chat_context_and_prompt(user_message, context, session_state):
     system_metrics = context.get("systemMetrics", {})
     state = load_state() or {}
@@ -304,19 +353,23 @@ def _build_chat_context_and_prompt(user_message, context, session_state):
         state["compact_summary_hash"] = summary_hash
         state["last_analysis_ts_snapshot"] = (state.get("last_analysis") or {}).get("timestamp")
         state["last_optimization_ts_snapshot"] = (state.get("last_optimization") or {}).get("timestamp")
-        save_state(state)
+        update_fields({k: state[k] for k in _CHAT_STATE_FIELDS + _SUMMARY_STATE_FIELDS})
     else:
         state["last_metrics"] = metrics_snapshot
-        save_state(state)
+        update_fields({k: state[k] for k in _CHAT_STATE_FIELDS})
 
-    messages = context.get("recentMessages") or []
+    session_id = session_state.get("id")
+    seed_conversation(session_id, context.get("recentMessages"))
+    record_turn(session_id, "user", user_message)
+    conversation_summary, recent_messages = get_conversation(session_id)
     compact_context = {
         "clinical_mode": state.get("clinical_mode"),
         "confidence": state.get("confidence"),
         "compact_summary": state.get("compact_summary") or generate_compact_summary(state),
-        "recent_messages": (messages or [])[-6:]
+        "conversation_summary": conversation_summary,
+        "recent_messages": recent_messages
     }
-    full_prompt = json.dumps(compact_context, ensure_ascii=False)
+    full_prompt = dumps(compact_context)
 
     return full_prompt, clinical_mode
 
@@ -324,18 +377,14 @@ def _build_chat_context_and_prompt(user_message, context, session_state):
 def _run_chat_llm(user_message, context, session_state):
     session_state = touch_session(session_state.get("id"))
     print("CHAT SESSION STATE BEFORE LLM:")
-    print(session_state)
+    print(loggable_session(session_state))
     guide_chat_active = context.get("guide_chat_active")
     if guide_chat_active is False:
         safe_payload = {
             "message": "El chat guiado está desactivado actualmente.",
-            "nextAction": {
-                "type": "none",
-                "label": "",
-                "autoExecute": False
-            },
+            "nextAction": NextAction.none().to_dict(),
             "mode": session_state.get("mode"),
-            "sessionState": session_state
+            "sessionState": _public_session(session_state)
         }
         return safe_payload, 200
     msg_lower = (user_message or "").lower()
@@ -355,13 +404,9 @@ def _run_chat_llm(user_message, context, session_state):
         app.logger.warning(f"CHAT_LLM_ABORT due to token estimate {approx_tokens}")
         safe_payload = {
             "message": "La solicitud fue bloqueada por tamaño excesivo del prompt.",
-            "nextAction": {
-                "type": "none",
-                "label": "",
-                "autoExecute": False
-            },
+            "nextAction": NextAction.none().to_dict(),
             "mode": session_state.get("mode"),
-            "sessionState": session_state
+            "sessionState": _public_session(session_state)
         }
         return safe_payload, 200
     system_prompt = get_system_prompt(session_state)
@@ -378,15 +423,13 @@ def _run_chat_llm(user_message, context, session_state):
 
     max_tokens = 120 if session_state.get("phase") == "idle_consult" else 200
     try:
-        raw = _call_groq(messages, max_tokens=max_tokens)
+        with admission_slot():
+            raw = _call_groq(messages, max_tokens=max_tokens)
         choice = (raw.get("choices") or [{}])[0]
         msg = (choice.get("message") or {})
         content = msg.get("content") or ""
 
-        try:
-            parsed = json.loads(content)
-        except Exception:
-            parsed = None
+        parsed = extract_llm_json(content)
 
         timestamp = datetime.utcnow().isoformat() + "Z"
 
@@ -399,27 +442,21 @@ def _run_chat_llm(user_message, context, session_state):
                 "validated_action": "none",
                 "executed_action": None
             }
-            app.logger.info("AI_CHAT_LOG %s", json.dumps(log_entry, ensure_ascii=False))
+            app.logger.info("AI_CHAT_LOG %s", dumps(log_entry))
+            record_turn(session_state.get("id"), "assistant", content.strip())
             safe_payload = {
                 "message": content.strip() or "No se pudo procesar correctamente la respuesta de la IA.",
-                "nextAction": {
-                    "type": "none",
-                    "label": "",
-                    "autoExecute": False
-                },
+                "nextAction": NextAction.none().to_dict(),
                 "mode": session_state.get("mode"),
-                "sessionState": session_state
+                "sessionState": _public_session(session_state)
             }
             return safe_payload, 200
 
         message_text = parsed.get("message") or ""
-        next_action = parsed.get("nextAction") or {}
-        action_type = next_action.get("type") or "none"
-        label = next_action.get("label") or ""
-        auto_execute = bool(next_action.get("autoExecute", False))
-
-        if action_type not in ["analyze", "optimize", "none"]:
-            action_type = "none"
+        if not isinstance(message_text, str):
+            message_text = str(message_text)
+        next_action = NextAction.from_llm(parsed.get("nextAction"))
+        action_type = next_action.type
 
         if clinical_mode == "needs_analysis":
             if action_type != "analyze":
@@ -443,19 +480,20 @@ def _run_chat_llm(user_message, context, session_state):
             "validated_action": action_type,
             "executed_action": None
         }
-        app.logger.info("AI_CHAT_LOG %s", json.dumps(log_entry, ensure_ascii=False))
+        app.logger.info("AI_CHAT_LOG %s", dumps(log_entry))
 
+        next_action.type = action_type
+        record_turn(session_state.get("id"), "assistant", message_text.strip())
         payload = {
             "message": message_text.strip() or "Respuesta recibida sin contenido legible.",
-            "nextAction": {
-                "type": action_type,
-                "label": label,
-                "autoExecute": auto_execute if action_type != "none" else False
-            },
+            "nextAction": next_action.to_dict(),
             "mode": session_state.get("mode"),
-            "sessionState": session_state
+            "sessionState": _public_session(session_state)
         }
         return payload, 200
+    except AdmissionRejected:
+        app.logger.warning("CHAT_LLM_SHED admission queue timeout")
+        return _throttled_payload(session_state, 5), 200
     except Exception as e:
         error_type = type(e).__name__
         error_message = str(e)
@@ -481,21 +519,24 @@ def chat_start():
     session_state = create_session()
     print("CHAT_START ENDPOINT HIT")
     print("SESSION_ID_CREATED:", session_state.get("id"))
-    return jsonify({"sessionId": session_state.get("id"), "sessionState": session_state}), 201
+    return json_response({"sessionId": session_state.get("id"), "sessionState": _public_session(session_state)}), 201
 
 
 @app.route('/api/chat/message', methods=['POST'])
 def chat_message():
-    data = request.json or {}
-    session_id = data.get("sessionId")
-    user_message = data.get("userMessage", "")
-    context = data.get("context") or {}
+    try:
+        chat_request = ChatRequest.from_dict(_request_json() or {})
+    except SchemaError as e:
+        return json_response({"error": str(e)}), 400
+    session_id = chat_request.session_id
+    user_message = chat_request.user_message
+    context = chat_request.context
 
     print("CHAT_MESSAGE ENDPOINT HIT")
     print("SESSION_ID_FROM_REQUEST:", session_id)
 
     if not user_message:
-        return jsonify({"error": "Mensaje vacío"}), 400
+        return json_response({"error": "Mensaje vacío"}), 400
 
     created_new = False
     session_state = None
@@ -503,7 +544,7 @@ def chat_message():
         session_state = get_session(session_id)
         if session_state is None:
             print("CHAT_MESSAGE SESSION NOT FOUND, NOT CREATING NEW")
-            return jsonify({"error": "Sesión no encontrada"}), 404
+            return json_response({"error": "Sesión no encontrada"}), 404
     else:
         session_state = create_session()
         created_new = True
@@ -511,37 +552,100 @@ def chat_message():
     print("SESSION_ID_USED:", session_state.get("id"))
     print("SESSION_WAS_CREATED:", created_new)
 
-    payload, status_code = _run_chat_llm(user_message, context, session_state)
-    return jsonify(payload), status_code
+    # La IP (primer salto de X-Forwarded-For vía ProxyFix) solo alimenta un
+    # bucket holgado: detrás de un NAT la comparten muchos usuarios, pero sin
+    # él un cliente que omite sessionId y deviceId nunca quedaría limitado.
+    device_id = chat_request.device_id or request.headers.get("X-Device-Id")
+    rate_keys = [f"session:{session_state.get('id')}"]
+    if device_id:
+        rate_keys.append(f"device:{device_id}")
+    allowed, retry_after = check_rate_limit(rate_keys, ip=request.remote_addr)
+    if allowed:
+        payload, status_code = _run_chat_llm(user_message, context, session_state)
+    else:
+        app.logger.warning(f"CHAT_RATE_LIMITED device={device_id} retryAfter={retry_after}")
+        payload, status_code = _throttled_payload(session_state, retry_after), 200
+    response = json_response(payload)
+    if payload.get("throttled"):
+        # Respuesta de degradación: 200 para que el cliente Electron conserve la sesión.
+        response.headers["Retry-After"] = str(payload["retryAfter"])
+        response.headers["Cache-Control"] = f"private, max-age={payload['retryAfter']}"
+    return response, status_code
 
 
 @app.route('/api/chat/session/<session_id>', methods=['GET'])
 def chat_session(session_id):
     session_state = get_session(session_id)
     if not session_state:
-        return jsonify({"error": "Sesión no encontrada"}), 404
-    return jsonify({"sessionId": session_state.get("id"), "sessionState": session_state}), 200
+        return json_response({"error": "Sesión no encontrada"}), 404
+    return json_response({"sessionId": session_state.get("id"), "sessionState": _public_session(session_state)}), 200
 
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    return jsonify({
+    return json_response({
         "error": "Endpoint /api/chat deprecado. Usa /api/chat/message con sesión guiada."
     }), 410
 
 @app.route('/api/ai-health', methods=['GET'])
 def ai_health():
-    return jsonify({
+    ensure_prober(GROQ_API_KEY, GROQ_MODELS_URL)
+    body, etag = health_body({
         "status": "ok",
         "gemini_configured": bool(GROQ_API_KEY),
         "gemini_model": GROQ_MODEL,
         "grok_configured": False
     })
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _session_store_health():
+    return {"ok": True, "sessions": session_count()}
+
+
+def _queue_health():
+    stats = queue_stats()
+    stats["ok"] = stats["depth"] < 1000
+    return stats
+
+
+def _upstream_health():
+    # Groq caído no impide servir /api/analyze ni las respuestas de
+    # degradación del chat: se informa pero no marca al backend como no listo.
+    upstream = upstream_snapshot()
+    upstream["ok"] = True
+    return upstream
+
+
+def _limiter_health():
+    stats = limiter_stats()
+    stats["ok"] = True
+    return stats
+
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    ensure_prober(GROQ_API_KEY, GROQ_MODELS_URL)
+    is_ready, checks = readiness_report({
+        "stateStore": state_store_health,
+        "sessionStore": _session_store_health,
+        "executedQueue": _queue_health,
+        "rateLimiter": _limiter_health,
+        "upstream": _upstream_health
+    })
+    return json_response({"ready": is_ready, "checks": checks}), 200 if is_ready else 503
 
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({"status": "CleanMate AI Backend is running", "version": "1.0.0"})
+    return json_response({"status": "CleanMate AI Backend is running", "version": "1.0.0"})
 
 if __name__ == '__main__':
+    start_executed_queue()
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,248 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+try:
+    from .json_codec import dumps, loads
+    from .state_service import load_state, get_clinical_mode, update_last_analysis, update_last_optimization, append_history
+except ImportError:
+    from services.json_codec import dumps, loads
+    from services.state_service import load_state, get_clinical_mode, update_last_analysis, update_last_optimization, append_history
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_journal_dir = os.path.join(_root_dir, "state")
+_journal_path = None
+_journal_lines = 0
+_max_journal_lines = int(os.getenv("EXECUTED_QUEUE_COMPACT_LINES", "1000"))
+# executed_jobs.<pid>.jsonl, opcionalmente renombrado a .claimed.<pid> por
+# el proceso que lo está recuperando; executed_jobs.jsonl es el formato antiguo.
+_JOURNAL_RE = re.compile(r"^executed_jobs(?:\.(\d+))?\.jsonl(?:\.claimed\.(\d+))?$")
+_worker_count = int(os.getenv("EXECUTED_QUEUE_WORKERS", "2"))
+_max_seen_keys = int(os.getenv("EXECUTED_QUEUE_MAX_KEYS", "1000"))
+
+_lock = threading.Lock()
+_queues = []
+_started_pid = None
+_seen_keys = OrderedDict()
+_pending_jobs = OrderedDict()
+_stats = {"enqueued": 0, "processed": 0, "duplicates": 0, "failed": 0}
+
+
+def idempotency_key_for(payload, header_key=None):
+    """Solo una clave explícita deduplica: dos reportes idénticos pueden ser eventos reales distintos."""
+    key = header_key or (payload.get("idempotencyKey") if isinstance(payload, dict) else None)
+    return str(key) if key else None
+
+
+def _append_journal(records):
+    global _journal_lines
+    with open(_journal_path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _journal_lines += len(records)
+
+
+def _compact_journal():
+    global _journal_lines
+    # Se llama con _lock tomado: nadie más escribe el journal de este proceso.
+    tmp_path = _journal_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for job in _pending_jobs.values():
+            f.write(dumps(job) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _journal_path)
+    _journal_lines = len(_pending_jobs)
+
+
+def _remember_key(key):
+    _seen_keys[key] = True
+    _seen_keys.move_to_end(key)
+    while len(_seen_keys) > _max_seen_keys:
+        _seen_keys.popitem(last=False)
+
+
+def _queue_for(device_id):
+    # Cada dispositivo siempre cae en la misma cola, así sus eventos se
+    # aplican en el orden en que llegaron.
+    index = int(hashlib.md5(device_id.encode("utf-8")).hexdigest(), 16) % len(_queues)
+    return _queues[index]
+
+
+def apply_executed_event(job):
+    event = job["event"]
+    event_type = event["type"]
+    print("===========================================")
+    print("EXECUTED QUEUE APPLY")
+    print("KEY:", job["key"], "DEVICE:", job["device"])
+    state_before = load_state()
+    print("LAST_ANALYSIS BEFORE:", state_before.get("last_analysis"))
+    print("LAST_OPTIMIZATION BEFORE:", state_before.get("last_optimization"))
+    if event_type == "analyze":
+        update_last_analysis(event["timestamp"], event["summary"])
+    elif event_type == "optimize":
+        update_last_optimization(event["timestamp"], event["summary"])
+    append_history(event)
+    print("CLINICAL_MODE_AFTER:", get_clinical_mode())
+    print("===========================================")
+
+
+def _worker(jobs):
+    while True:
+        job = jobs.get()
+        try:
+            apply_executed_event(job)
+            with _lock:
+                _pending_jobs.pop(job["key"], None)
+                _append_journal([{"key": job["key"], "done": True}])
+                if _journal_lines > _max_journal_lines:
+                    _compact_journal()
+                _stats["processed"] += 1
+        except Exception as e:
+            print("EXECUTED QUEUE ERROR:", job.get("key"), e)
+            with _lock:
+                _stats["failed"] += 1
+        finally:
+            jobs.task_done()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _claim_orphan_journals():
+    """Reclama (por rename atómico) los journals de procesos que ya no existen."""
+    own_pid = os.getpid()
+    claimed = []
+    for name in sorted(os.listdir(_journal_dir)):
+        match = _JOURNAL_RE.match(name)
+        if not match:
+            continue
+        owner = match.group(2) or match.group(1)
+        owner_pid = int(owner) if owner else None
+        # Un journal con nuestro pid es de un proceso anterior (pid reutilizado):
+        # este proceso aún no ha escrito nada.
+        if owner_pid is not None and owner_pid != own_pid and _pid_alive(owner_pid):
+            continue
+        path = os.path.join(_journal_dir, name)
+        base = path.split(".claimed.")[0]
+        claimed_path = f"{base}.claimed.{own_pid}"
+        try:
+            if path != claimed_path:
+                os.rename(path, claimed_path)
+        except FileNotFoundError:
+            continue
+        claimed.append(claimed_path)
+    return claimed
+
+
+def _read_pending(paths):
+    pending = OrderedDict()
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    continue
+                key = record.get("key")
+                if not key:
+                    continue
+                _remember_key(key)
+                if record.get("done"):
+                    pending.pop(key, None)
+                else:
+                    pending[key] = record
+    return list(pending.values())
+
+
+def _ensure_started():
+    global _started_pid, _journal_path, _journal_lines
+    if _started_pid == os.getpid():
+        return
+    # Los hilos no sobreviven al fork de gunicorn: cada worker arranca su propio
+    # pool y escribe su propio journal, así ningún worker toca el de otro vivo.
+    os.makedirs(_journal_dir, exist_ok=True)
+    _queues.clear()
+    _pending_jobs.clear()
+    for _ in range(max(1, _worker_count)):
+        jobs = queue.Queue()
+        threading.Thread(target=_worker, args=(jobs,), daemon=True).start()
+        _queues.append(jobs)
+    _started_pid = os.getpid()
+    _journal_path = os.path.join(_journal_dir, f"executed_jobs.{_started_pid}.jsonl")
+    _journal_lines = 0
+    claimed = _claim_orphan_journals()
+    recovered = _read_pending(claimed)
+    # Los pendientes pasan al journal propio antes de borrar los reclamados.
+    _append_journal(recovered)
+    for path in claimed:
+        os.remove(path)
+    for job in recovered:
+        _pending_jobs[job["key"]] = job
+        _queue_for(job["device"]).put(job)
+    if recovered:
+        print("EXECUTED QUEUE RECOVERED:", len(recovered))
+
+
+def start():
+    """Arranca el pool y recupera eventos pendientes; se llama al iniciar cada worker."""
+    with _lock:
+        _ensure_started()
+
+
+def enqueue_executed(executed, key=None):
+    """Registra el evento en el journal y lo encola; devuelve False si la clave ya se había visto.
+
+    Las claves vistas viven en memoria de este proceso (y en su journal), así
+    que la deduplicación no cubre reintentos que llegan a otro worker.
+    """
+    with _lock:
+        _ensure_started()
+        if key is not None and key in _seen_keys:
+            _stats["duplicates"] += 1
+            return False
+        if key is None:
+            key = f"job:{uuid.uuid4().hex}"
+        job = {
+            "key": key,
+            "device": executed.device_id,
+            "event": executed.to_history_event()
+        }
+        _append_journal([job])
+        _pending_jobs[key] = job
+        _remember_key(key)
+        _stats["enqueued"] += 1
+        _queue_for(job["device"]).put(job)
+    return True
+
+
+def queue_depth():
+    return sum(jobs.unfinished_tasks for jobs in _queues)
+
+
+def queue_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats["depth"] = queue_depth()
+    stats["workers"] = len(_queues)
+    stats["pid"] = os.getpid()
+    stats["dedupScope"] = "process"
+    return stats
+
+
+def wait_idle():
+    for jobs in list(_queues):
+        jobs.join()
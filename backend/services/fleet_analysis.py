@@ -0,0 +1,178 @@
+import math
+import os
+import time
+
+try:
+    from .json_codec import dumps_bytes, loads
+except ImportError:
+    from services.json_codec import dumps_bytes, loads
+
+RISK_LEVELS = ("low", "medium", "high", "critical")
+
+# (warning, critical) por métrica, en porcentaje.
+THRESHOLDS = {
+    "cpu": (float(os.getenv("FLEET_CPU_WARN", "70")), float(os.getenv("FLEET_CPU_CRIT", "90"))),
+    "ram": (float(os.getenv("FLEET_RAM_WARN", "75")), float(os.getenv("FLEET_RAM_CRIT", "90"))),
+    "disk": (float(os.getenv("FLEET_DISK_WARN", "80")), float(os.getenv("FLEET_DISK_CRIT", "95")))
+}
+_CHUNK_SIZE = 1000
+
+
+def build_analysis_message(system_info, cleanup_info):
+    cpu = system_info.get('cpu')
+    ram = system_info.get('ram_percent')
+    disk = system_info.get('disk_percent')
+
+    status_parts = []
+    if cpu is not None:
+        status_parts.append(f"CPU {cpu}%")
+    if ram is not None:
+        status_parts.append(f"RAM {ram}%")
+    if disk is not None:
+        status_parts.append(f"Disco {disk}%")
+    status_text = ", ".join(status_parts) if status_parts else "sin métricas claras"
+
+    freed_mb = cleanup_info.get('freed_mb')
+    files_deleted = cleanup_info.get('files_deleted')
+    cleanup_summary = ""
+    if freed_mb is not None or files_deleted is not None:
+        cleanup_summary = f" Limpieza reciente: liberados {freed_mb or 0} MB en {files_deleted or 0} elementos."
+
+    return f"Estado actual: {status_text}.{cleanup_summary} Se recomienda revisar procesos en segundo plano y considerar una optimización si percibes lentitud."
+
+
+def iter_machines(body, stream=None, ndjson=False):
+    """Acepta un array JSON, {"machines": [...]} o NDJSON (una máquina por línea)."""
+    if ndjson:
+        for line in stream if stream is not None else body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except ValueError:
+                yield None
+        return
+    data = loads(body)
+    if isinstance(data, dict):
+        data = data.get("machines")
+    if not isinstance(data, list):
+        raise ValueError("Se esperaba un array de máquinas")
+    yield from data
+
+
+# Métrica presente pero ilegible: no debe clasificarse como sana.
+INVALID = object()
+
+
+def _metric(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return INVALID
+    if isinstance(value, str):
+        try:
+            value = float(value.strip().rstrip("%"))
+        except ValueError:
+            return INVALID
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        return INVALID
+    return float(value)
+
+
+def _levels(column, thresholds):
+    warn, crit = thresholds
+    return [
+        0 if v is None else (-1 if v is INVALID else (2 if v >= crit else (1 if v >= warn else 0)))
+        for v in column
+    ]
+
+
+def evaluate_chunk(machines, offset=0):
+    """Evalúa un bloque de máquinas por columnas: una pasada por métrica en lugar de un if por máquina."""
+    valid = [isinstance(m, dict) and isinstance(m.get("system_info"), dict) for m in machines]
+    infos = [m["system_info"] if ok else {} for m, ok in zip(machines, valid)]
+    cpu = [_metric(i.get("cpu")) for i in infos]
+    ram = [_metric(i.get("ram_percent")) for i in infos]
+    disk = [_metric(i.get("disk_percent")) for i in infos]
+    cpu_l = _levels(cpu, THRESHOLDS["cpu"])
+    ram_l = _levels(ram, THRESHOLDS["ram"])
+    disk_l = _levels(disk, THRESHOLDS["disk"])
+
+    results = []
+    for index, machine in enumerate(machines):
+        machine_id = machine.get("id") if isinstance(machine, dict) else None
+        if machine_id is None:
+            machine_id = offset + index
+        if not valid[index]:
+            results.append({"id": machine_id, "status": "error", "error": "Datos inválidos"})
+            continue
+        levels = (cpu_l[index], ram_l[index], disk_l[index])
+        invalid = [name for name, level in zip(("cpu", "ram", "disk"), levels) if level == -1]
+        if invalid:
+            results.append({
+                "id": machine_id,
+                "status": "error",
+                "error": f"Métricas inválidas: {', '.join(invalid)}",
+                "flags": [f"{name}_invalid" for name in invalid]
+            })
+            continue
+        criticals = levels.count(2)
+        warnings = levels.count(1)
+        if criticals >= 2:
+            risk = "critical"
+        elif criticals == 1:
+            risk = "high"
+        elif warnings:
+            risk = "medium"
+        else:
+            risk = "low"
+        flags = [name for name, level in zip(("cpu", "ram", "disk"), levels) if level]
+        cleanup_info = machine.get("cleanup_info")
+        if not isinstance(cleanup_info, dict):
+            cleanup_info = {}
+        try:
+            message = build_analysis_message(infos[index], cleanup_info)
+        except Exception as e:
+            # Un error de una máquina no debe cortar el stream del resto del lote.
+            results.append({"id": machine_id, "status": "error", "error": str(e)})
+            continue
+        results.append({
+            "id": machine_id,
+            "status": "ok",
+            "risk": risk,
+            "flags": flags,
+            "message": message
+        })
+    return results
+
+
+def stream_batch(machines):
+    """Genera líneas NDJSON con el resultado de cada máquina y una línea final de resumen."""
+    started_at = time.perf_counter()
+    counts = dict.fromkeys(RISK_LEVELS + ("error",), 0)
+    total = 0
+    chunk = []
+    for machine in machines:
+        chunk.append(machine)
+        if len(chunk) < _CHUNK_SIZE:
+            continue
+        for result in evaluate_chunk(chunk, total):
+            counts[result.get("risk") or "error"] += 1
+            yield dumps_bytes(result) + b"\n"
+        total += len(chunk)
+        chunk = []
+    if chunk:
+        for result in evaluate_chunk(chunk, total):
+            counts[result.get("risk") or "error"] += 1
+            yield dumps_bytes(result) + b"\n"
+        total += len(chunk)
+    elapsed = time.perf_counter() - started_at
+    summary = {
+        "machines": total,
+        "byRisk": counts,
+        "elapsedMs": int(elapsed * 1000),
+        "machinesPerSec": int(total / elapsed) if elapsed > 0 else total
+    }
+    print("FLEET BATCH SUMMARY:", summary)
+    yield dumps_bytes({"summary": summary}) + b"\n"
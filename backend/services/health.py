@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+try:
+    from .json_codec import dumps_bytes
+except ImportError:
+    from services.json_codec import dumps_bytes
+
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "60"))
+PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+_PROBE_WINDOW = 10
+
+_lock = threading.Lock()
+_started_pid = None
+_probe_url = None
+_api_key = None
+_recent = deque(maxlen=_PROBE_WINDOW)
+_upstream = {"status": "unknown", "checkedAt": None, "latencyMs": None, "httpStatus": None, "successRate": None}
+# Cuerpo y ETag precalculados: cada request de health solo copia referencias.
+_cached = {"base": None, "upstream": None, "body": None, "etag": None}
+
+
+def _public_upstream():
+    # Solo lo que cambia de forma significativa entra en el ETag; la latencia
+    # se redondea para que probes equivalentes no invaliden el caché del cliente.
+    latency_ms = _upstream["latencyMs"]
+    return {
+        "status": _upstream["status"],
+        "successRate": _upstream["successRate"],
+        "latencyMs": None if latency_ms is None else int(round(latency_ms, -2))
+    }
+
+
+def _rebuild(base):
+    payload = dict(base)
+    payload["upstream"] = _public_upstream()
+    body = dumps_bytes(payload)
+    _cached["base"] = base
+    _cached["upstream"] = payload["upstream"]
+    _cached["body"] = body
+    _cached["etag"] = hashlib.sha1(body).hexdigest()
+
+
+def probe_once():
+    import requests
+    started_at = time.perf_counter()
+    http_status = None
+    try:
+        resp = requests.get(_probe_url, headers={"Authorization": f"Bearer {_api_key}"}, timeout=PROBE_TIMEOUT)
+        http_status = resp.status_code
+        ok = resp.status_code == 200
+    except Exception:
+        ok = False
+    latency_ms = int((time.perf_counter() - started_at) * 1000)
+    with _lock:
+        _recent.append(ok)
+        _upstream.update({
+            "status": "ok" if ok else "degraded",
+            "checkedAt": datetime.now(timezone.utc).isoformat(),
+            "latencyMs": latency_ms,
+            "httpStatus": http_status,
+            "successRate": round(sum(_recent) / len(_recent), 2)
+        })
+        if _cached["base"] is not None and _cached["upstream"] != _public_upstream():
+            _rebuild(_cached["base"])
+
+
+def _prober():
+    while True:
+        probe_once()
+        time.sleep(PROBE_INTERVAL)
+
+
+def ensure_prober(api_key, probe_url):
+    """Arranca el prober en segundo plano una vez por proceso (los hilos no sobreviven al fork)."""
+    global _started_pid, _api_key, _probe_url
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        _api_key = api_key
+        _probe_url = probe_url
+        if not api_key:
+            _upstream["status"] = "not_configured"
+            return
+    threading.Thread(target=_prober, daemon=True).start()
+
+
+def health_body(base):
+    """Devuelve (body, etag) cacheados; solo se recalculan si cambia la parte estática o llega un probe."""
+    with _lock:
+        if _cached["base"] != base:
+            _rebuild(base)
+        return _cached["body"], _cached["etag"]
+
+
+def upstream_snapshot():
+    with _lock:
+        return dict(_upstream)
+
+
+def readiness_report(checks):
+    """Ejecuta cada check (nombre -> callable que devuelve un dict con "ok") y resume el resultado."""
+    results = {}
+    ready = True
+    for name, check in checks.items():
+        try:
+            result = check()
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        results[name] = result
+        ready = ready and bool(result.get("ok"))
+    return ready, results
@@ -0,0 +1,43 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ambos backends producen JSON compacto en UTF-8 para que la salida sea
+# la misma con o sin orjson instalado.
+_SEPARATORS = (",", ":")
+
+
+def backend_name():
+    return "orjson" if orjson is not None else "json"
+
+
+def dumps_bytes(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=_SEPARATORS).encode("utf-8")
+
+
+def dumps(obj):
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+def dump(obj, f):
+    f.write(dumps(obj))
+
+
+def load(f):
+    return loads(f.read())
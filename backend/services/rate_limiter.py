@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_db_path = os.getenv("RATE_LIMIT_DB", os.path.join(_root_dir, "state", "rate_limit.db"))
+
+RATE_PER_MIN = float(os.getenv("CHAT_RATE_PER_MIN", "20"))
+BURST = float(os.getenv("CHAT_RATE_BURST", "5"))
+IP_RATE_PER_MIN = float(os.getenv("CHAT_IP_RATE_PER_MIN", "120"))
+IP_BURST = float(os.getenv("CHAT_IP_RATE_BURST", "20"))
+SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))
+MAX_INFLIGHT = int(os.getenv("GROQ_MAX_INFLIGHT", "4"))
+QUEUE_TIMEOUT = float(os.getenv("GROQ_QUEUE_TIMEOUT", "2"))
+
+
+class AdmissionRejected(RuntimeError):
+    pass
+
+
+def _refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + (now - updated_at) * rate)
+
+
+def _full_at(tokens, now, rate, burst):
+    # Momento en que el bucket vuelve a estar lleno: a partir de ahí es
+    # equivalente a no tenerlo y se puede borrar.
+    return now + (burst - tokens) / rate if rate > 0 else float("inf")
+
+
+def _take_all(buckets, limits, now):
+    """buckets: {clave: (tokens, updated_at)}, limits: {clave: (rate, burst)}. Solo descuenta si todas tienen un token."""
+    refilled = {}
+    for key, (tokens, updated_at) in buckets.items():
+        rate, burst = limits[key]
+        refilled[key] = _refill(tokens, updated_at, now, rate, burst)
+    allowed = all(tokens >= 1 for tokens in refilled.values())
+    if allowed:
+        refilled = {key: tokens - 1 for key, tokens in refilled.items()}
+    return allowed, refilled
+
+
+class MemoryBucketStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._next_sweep = 0
+
+    def take_all(self, limits, now):
+        with self._lock:
+            current = {key: self._buckets.get(key, (burst, now, now))[:2] for key, (_, burst) in limits.items()}
+            allowed, refilled = _take_all(current, limits, now)
+            for key, tokens in refilled.items():
+                rate, burst = limits[key]
+                self._buckets[key] = (tokens, now, _full_at(tokens, now, rate, burst))
+            if now >= self._next_sweep:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+                self._next_sweep = now + SWEEP_INTERVAL
+        return allowed, refilled
+
+
+class SqliteBucketStore:
+    """Buckets en un archivo SQLite del mismo host: compartidos entre workers de gunicorn."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._path = path
+        self._local = threading.local()
+        self._next_sweep = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL, full_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS token_buckets_full_at ON token_buckets (full_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take_all(self, limits, now):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            current = {}
+            for key, (_, burst) in limits.items():
+                row = conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                current[key] = row if row else (burst, now)
+            allowed, refilled = _take_all(current, limits, now)
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                [(key, tokens, now, _full_at(tokens, now, *limits[key])) for key, tokens in refilled.items()]
+            )
+            if now >= self._next_sweep:
+                conn.execute("DELETE FROM token_buckets WHERE full_at <= ?", (now,))
+                self._next_sweep = now + SWEEP_INTERVAL
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return allowed, refilled
+
+
+def _build_store():
+    if os.getenv("RATE_LIMIT_STORE", "memory") == "sqlite":
+        return SqliteBucketStore(_db_path)
+    return MemoryBucketStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+_inflight = threading.BoundedSemaphore(max(1, MAX_INFLIGHT))
+_stats_lock = threading.Lock()
+_stats = {"allowed": 0, "limited": 0, "admitted": 0, "shed": 0, "errors": 0}
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _build_store()
+    return _store
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def check_rate_limit(keys, ip=None):
+    """Consume un token de cada clave (sesión, dispositivo) y del bucket de IP solo si todos tienen.
+
+    El bucket de IP es más holgado (muchos usuarios pueden compartir una IP
+    tras un NAT) pero impide saltarse el límite creando sesiones nuevas.
+    Devuelve (permitido, segundos_para_reintentar).
+    """
+    limits = {key: (RATE_PER_MIN / 60.0, BURST) for key in keys if key}
+    if ip:
+        limits[f"ip:{ip}"] = (IP_RATE_PER_MIN / 60.0, IP_BURST)
+    if not limits:
+        return True, 0
+    try:
+        allowed, tokens = _get_store().take_all(limits, time.time())
+    except Exception as e:
+        # Si el store no responde (SQLite ocupado, disco lleno) el limitador
+        # deja pasar la request: es preferible a convertirla en un 500.
+        print("RATE_LIMITER ERROR (fail open):", type(e).__name__, e)
+        _count("errors")
+        return True, 0
+    if allowed:
+        _count("allowed")
+        return True, 0
+    _count("limited")
+    retry_after = 0
+    for key, value in tokens.items():
+        rate = limits[key][0]
+        if value < 1:
+            retry_after = max(retry_after, (1 - value) / rate if rate > 0 else 60)
+    return False, max(1, int(retry_after + 0.999))
+
+
+@contextmanager
+def admission_slot():
+    """Limita las llamadas simultáneas a Groq; espera hasta GROQ_QUEUE_TIMEOUT y si no, rechaza."""
+    if not _inflight.acquire(timeout=QUEUE_TIMEOUT):
+        _count("shed")
+        raise AdmissionRejected("Groq admission queue timeout")
+    _count("admitted")
+    try:
+        yield
+    finally:
+        _inflight.release()
+
+
+def limiter_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["maxInflight"] = MAX_INFLIGHT
+    stats["store"] = type(_get_store()).__name__
+    return stats
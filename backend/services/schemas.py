@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Optional
+
+ACTION_TYPES = ("analyze", "optimize", "none")
+EXECUTED_TYPES = ("analyze", "optimize")
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _now_iso_z():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _optional_str(data, key):
+    value = data.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise SchemaError(f"'{key}' debe ser texto")
+    return value
+
+
+def _coerce_id(value):
+    # Identificadores opcionales del cliente: se aceptan números y se ignora
+    # cualquier otro tipo en lugar de rechazar la request.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    return None
+
+
+@dataclass(slots=True)
+class NextAction:
+    type: str = "none"
+    label: str = ""
+    autoExecute: bool = False
+
+    @classmethod
+    def none(cls):
+        return cls()
+
+    @classmethod
+    def from_llm(cls, data):
+        # La salida del LLM no es confiable: se normaliza en lugar de rechazarla.
+        if not isinstance(data, dict):
+            return cls()
+        action_type = data.get("type") or "none"
+        if action_type not in ACTION_TYPES:
+            action_type = "none"
+        label = data.get("label") or ""
+        if not isinstance(label, str):
+            label = str(label)
+        return cls(action_type, label, bool(data.get("autoExecute", False)))
+
+    def to_dict(self):
+        return {
+            "type": self.type,
+            "label": self.label,
+            "autoExecute": self.autoExecute if self.type != "none" else False
+        }
+
+
+@dataclass(slots=True)
+class ChatRequest:
+    session_id: Optional[str]
+    user_message: str
+    context: dict
+    device_id: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise SchemaError("Datos inválidos")
+        context = data.get("context") or {}
+        if not isinstance(context, dict):
+            raise SchemaError("'context' debe ser un objeto")
+        user_message = data.get("userMessage") or ""
+        if not isinstance(user_message, str):
+            raise SchemaError("'userMessage' debe ser texto")
+        device_id = _coerce_id(data.get("deviceId")) or _coerce_id(context.get("deviceId"))
+        return cls(_optional_str(data, "sessionId"), user_message, context, device_id)
+
+
+@dataclass(slots=True)
+class ExecutedEvent:
+    type: str
+    report: Any
+    device_id: str = "default"
+    timestamp: str = field(default_factory=_now_iso_z)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise SchemaError("Invalid payload")
+        event_type = data.get("type")
+        report = data.get("report")
+        if event_type not in EXECUTED_TYPES or report is None:
+            raise SchemaError("Invalid payload")
+        return cls(event_type, report, _coerce_id(data.get("deviceId")) or "default")
+
+    def to_history_event(self):
+        return {
+            "type": self.type,
+            "timestamp": self.timestamp,
+            "summary": self.report
+        }
+
+
+@dataclass(slots=True)
+class SessionState:
+    id: str
+    mode: str
+    clinicalMode: str
+    flowCompleted: bool
+    phase: str
+    step: int
+    createdAt: str
+    updatedAt: str
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict) or not data.get("id"):
+            raise SchemaError("Sesión inválida")
+        return cls(
+            data["id"],
+            data.get("mode") or "guided_flow",
+            data.get("clinicalMode") or "needs_analysis",
+            bool(data.get("flowCompleted")),
+            data.get("phase") or "analysis",
+            int(data.get("step") or 1),
+            data.get("createdAt") or "",
+            data.get("updatedAt") or ""
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "clinicalMode": self.clinicalMode,
+            "flowCompleted": self.flowCompleted,
+            "phase": self.phase,
+            "step": self.step,
+            "createdAt": self.createdAt,
+            "updatedAt": self.updatedAt
+        }
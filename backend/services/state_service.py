@@ -1,18 +1,36 @@
 import os
-import json
+import tempfile
+import threading
 from datetime import datetime, timezone
 
+try:
+    from .json_codec import dump, dumps, load, loads
+except ImportError:
+    from services.json_codec import dump, dumps, load, loads
+
 _root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _state_dir = os.path.join(_root_dir, "state")
 _state_path = os.path.join(_state_dir, "system_state.json")
+_history_path = os.path.join(_state_dir, "history.jsonl")
 _state = None
+_history = None
+_version = 0
+_persisted_version = -1
+
+# _state nunca se modifica en sitio: cada escritura publica un dict nuevo
+# bajo _swap_lock, así los lectores usan la referencia actual sin bloquear.
+# Los read-modify-write sobre una clave se serializan con su franja de
+# _key_locks para que escritores de claves distintas no se esperen entre sí.
+_swap_lock = threading.RLock()
+_persist_lock = threading.Lock()
+_history_lock = threading.Lock()
+_key_locks = [threading.Lock() for _ in range(16)]
 
 
 def _default_state():
     return {
         "last_analysis": None,
         "last_optimization": None,
-        "history": [],
         "compact_summary": "",
         "compact_summary_hash": "",
         "last_metrics": None,
@@ -23,54 +41,157 @@ def _default_state():
     }
 
 
-def load_state():
-    global _state
+def _ensure_state_dir():
     if not os.path.isdir(_state_dir):
         os.makedirs(_state_dir, exist_ok=True)
-    if _state is not None:
-        return _state
+
+
+def _read_state_file():
     if not os.path.isfile(_state_path):
-        _state = _default_state()
-        save_state(_state)
-        return _state
+        return _default_state(), None, True
     try:
         with open(_state_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+            data = load(f)
             if not isinstance(data, dict):
                 data = _default_state()
     except Exception:
         data = _default_state()
+    # Estados antiguos guardaban el historial dentro del mismo JSON; se migra
+    # al archivo de historial para no cargarlo en cada arranque.
+    legacy_history = data.pop("history", None)
     for k, v in _default_state().items():
         if k not in data:
             data[k] = v
-    _state = data
+    return data, legacy_history, legacy_history is not None
+
+
+def snapshot():
+    """Estado actual compartido; solo lectura, no debe modificarse."""
+    if _state is not None:
+        return _state
+    with _swap_lock:
+        if _state is not None:
+            return _state
+        _ensure_state_dir()
+        data, legacy_history, needs_save = _read_state_file()
+        _publish(data)
+        if needs_save:
+            # El estado sin historial se persiste antes de copiar el historial
+            # antiguo: si el proceso cae entre ambos pasos, el siguiente arranque
+            # no vuelve a encontrar "history" y no lo duplica.
+            _persist()
+        if legacy_history is not None:
+            for event_object in legacy_history if isinstance(legacy_history, list) else []:
+                _write_history_line(event_object)
     return _state
 
 
-def save_state(state):
-    global _state
-    if not os.path.isdir(_state_dir):
-        os.makedirs(_state_dir, exist_ok=True)
+def load_state():
+    return dict(snapshot())
+
+
+def _publish(state):
+    global _state, _version
+    state.pop("history", None)
     _state = state
-    with open(_state_path, "w", encoding="utf-8") as f:
-        json.dump(_state, f, ensure_ascii=False)
+    _version += 1
+
+
+def _persist():
+    global _persisted_version
+    with _persist_lock:
+        state, version = _state, _version
+        if version <= _persisted_version:
+            return
+        _ensure_state_dir()
+        # _persist_lock solo serializa hilos de este proceso: cada escritura usa
+        # su propio archivo temporal para que dos workers no mezclen contenido.
+        fd, tmp_path = tempfile.mkstemp(prefix="system_state.", suffix=".tmp", dir=_state_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                dump(state, f)
+            os.replace(tmp_path, _state_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _persisted_version = version
+
+
+def save_state(state):
+    """Reemplaza el estado completo; para cambios parciales usar update_fields."""
+    with _swap_lock:
+        _publish(dict(state))
+    _persist()
+    return _state
+
+
+def state_store_health():
+    state = snapshot()
+    return {
+        "ok": isinstance(state, dict) and os.access(_state_dir, os.W_OK),
+        "version": _version,
+        "persistedVersion": _persisted_version
+    }
+
+
+def _stripes_for(keys):
+    indexes = sorted({hash(key) % len(_key_locks) for key in keys})
+    return [_key_locks[i] for i in indexes]
+
+
+def update_fields(fields):
+    """Aplica varias claves de forma atómica sobre el estado más reciente."""
+    snapshot()
+    with _swap_lock:
+        new_state = dict(_state)
+        new_state.update(fields)
+        _publish(new_state)
+    _persist()
     return _state
 
 
+def update_key(key, fn):
+    """Read-modify-write atómico de una clave: guarda fn(valor_actual)."""
+    snapshot()
+    stripes = _stripes_for([key])
+    for lock in stripes:
+        lock.acquire()
+    try:
+        value = fn(_state.get(key))
+        update_fields({key: value})
+    finally:
+        for lock in reversed(stripes):
+            lock.release()
+    return value
+
+
+def compare_and_swap(key, expected, value):
+    """Escribe value solo si la clave sigue valiendo expected; devuelve True si se aplicó."""
+    snapshot()
+    stripes = _stripes_for([key])
+    for lock in stripes:
+        lock.acquire()
+    try:
+        if _state.get(key) != expected:
+            return False
+        update_fields({key: value})
+        return True
+    finally:
+        for lock in reversed(stripes):
+            lock.release()
+
+
 def update_last_analysis(timestamp, summary):
-    state = load_state()
     print("===================================")
     print("STATE_SERVICE UPDATE_LAST_ANALYSIS CALLED")
     print("STATE BEFORE UPDATE:")
-    print(state)
-    state["last_analysis"] = {
+    print(snapshot())
+    last_analysis = {
         "timestamp": timestamp,
         "summary": summary
     }
-    print("STATE AFTER UPDATE (BEFORE SAVE):")
-    print(state)
-    save_state(state)
-    persisted = load_state()
+    persisted = update_fields({"last_analysis": last_analysis})
     print("STATE AFTER PERSIST (ANALYSIS):")
     print("LAST_ANALYSIS:", persisted.get("last_analysis"))
     print("LAST_OPTIMIZATION:", persisted.get("last_optimization"))
@@ -79,19 +200,15 @@ def update_last_analysis(timestamp, summary):
 
 
 def update_last_optimization(timestamp, summary):
-    state = load_state()
     print("===================================")
     print("STATE_SERVICE UPDATE_LAST_OPTIMIZATION CALLED")
     print("STATE BEFORE UPDATE:")
-    print(state)
-    state["last_optimization"] = {
+    print(snapshot())
+    last_optimization = {
         "timestamp": timestamp,
         "summary": summary
     }
-    print("STATE AFTER UPDATE (BEFORE SAVE):")
-    print(state)
-    save_state(state)
-    persisted = load_state()
+    persisted = update_fields({"last_optimization": last_optimization})
     print("STATE AFTER PERSIST (OPTIMIZATION):")
     print("LAST_ANALYSIS:", persisted.get("last_analysis"))
     print("LAST_OPTIMIZATION:", persisted.get("last_optimization"))
@@ -99,12 +216,38 @@ def update_last_optimization(timestamp, summary):
     print("===================================")
 
 
+def _write_history_line(event_object):
+    _ensure_state_dir()
+    line = dumps(event_object) + "\n"
+    with _history_lock:
+        with open(_history_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def get_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            history = []
+            if os.path.isfile(_history_path):
+                with open(_history_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            history.append(loads(line))
+                        except Exception:
+                            continue
+            _history = history
+        return list(_history)
+
+
 def append_history(event_object):
-    state = load_state()
-    history = state.get("history") or []
-    history.append(event_object)
-    state["history"] = history
-    save_state(state)
+    _write_history_line(event_object)
+    with _history_lock:
+        if _history is not None:
+            _history.append(event_object)
 
 
 def _parse_timestamp(value):
@@ -119,7 +262,7 @@ def _parse_timestamp(value):
 
 
 def get_clinical_mode():
-    state = load_state()
+    state = snapshot()
     last_analysis = state.get("last_analysis")
     last_optimization = state.get("last_optimization")
     print("=== STATE DEBUG (GET_CLINICAL_MODE INPUT) ===")
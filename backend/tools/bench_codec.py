@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_codec import backend_name, dumps_bytes, loads
+from services.schemas import ChatRequest, NextAction
+
+_REQUEST = {
+    "sessionId": "3b8a8237-4b24-42bf-9cfc-5a0f425b4a2c",
+    "userMessage": "¿Puedes ver las métricas de mi equipo?",
+    "context": {
+        "systemMetrics": {"cpuLoad": 95, "ramUsed": 88, "diskUsed": 85, "diskFreeGB": 34},
+        "recentMessages": [{"role": "user", "content": "Hola, ¿cómo está mi equipo?"}] * 6
+    }
+}
+_RESPONSE = {
+    "message": "El sistema requiere un análisis para determinar su condición actual.",
+    "nextAction": {"type": "analyze", "label": "Realizar Análisis", "autoExecute": False},
+    "mode": "guided_flow",
+    "sessionState": {"id": _REQUEST["sessionId"], "mode": "guided_flow", "phase": "analysis", "step": 1}
+}
+
+
+def _dict_path(raw):
+    data = json.loads(raw)
+    user_message = data.get("userMessage", "")
+    context = data.get("context") or {}
+    next_action = _RESPONSE["nextAction"]
+    payload = dict(_RESPONSE)
+    payload["nextAction"] = {
+        "type": next_action.get("type") or "none",
+        "label": next_action.get("label") or "",
+        "autoExecute": bool(next_action.get("autoExecute", False))
+    }
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8"), user_message, context
+
+
+def _codec_path(raw):
+    chat_request = ChatRequest.from_dict(loads(raw))
+    payload = dict(_RESPONSE)
+    payload["nextAction"] = NextAction.from_llm(_RESPONSE["nextAction"]).to_dict()
+    return dumps_bytes(payload), chat_request.user_message, chat_request.context
+
+
+def _run(fn, raw, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        fn(raw)
+    return iterations / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el camino dict+json con el codec y los esquemas")
+    parser.add_argument("--iterations", type=int, default=50000)
+    args = parser.parse_args()
+    raw = json.dumps(_REQUEST, ensure_ascii=False).encode("utf-8")
+    dict_ops = _run(_dict_path, raw, args.iterations)
+    codec_ops = _run(_codec_path, raw, args.iterations)
+    print(f"CODEC backend={backend_name()} iterations={args.iterations}")
+    print(f"dict_path opsPerSec={dict_ops:.0f}")
+    print(f"codec_path opsPerSec={codec_ops:.0f} speedup={codec_ops / dict_ops:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
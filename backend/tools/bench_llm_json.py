@@ -0,0 +1,114 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_repo_dir = os.path.dirname(_backend_dir)
+sys.path.insert(0, _backend_dir)
+
+from ai.llm_json import extract_llm_json
+
+
+# Marca las variantes de texto plano: se espera None para que el servidor muestre el contenido crudo.
+_PLAIN = object()
+
+
+def _stdlib_parse(content):
+    try:
+        parsed = json.loads(content)
+    except Exception:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def build_corpus():
+    """Reconstruye salidas del LLM a partir de los transcripts CleanMate_Chat_*.json y genera variantes dañadas."""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(_repo_dir, "CleanMate_Chat_*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            transcript = json.load(f)
+        for entry in transcript:
+            if entry.get("role") != "assistant" or not entry.get("message"):
+                continue
+            suggestion = entry.get("actionSuggestion") or {}
+            original = {
+                "message": entry["message"],
+                "nextAction": {
+                    "type": suggestion.get("type") or "none",
+                    "label": suggestion.get("label") or "",
+                    "autoExecute": False
+                }
+            }
+            raw = json.dumps(original, ensure_ascii=False, indent=2)
+            expected = entry["message"]
+            corpus.append(("exact", raw, expected))
+            corpus.append(("fenced", "```json\n" + raw + "\n```", expected))
+            corpus.append(("leading_text", "Aquí está la respuesta:\n" + raw, expected))
+            cut = raw.index('"nextAction"') + 20
+            corpus.append(("truncated_action", raw[:cut], expected))
+            message_end = raw.index('"nextAction"')
+            corpus.append(("truncated_message", raw[:message_end - 10], None))
+            corpus.append(("invalid_block_before", "Nota {x}: " + raw, expected))
+            # Corte a mitad de un escape \uXXXX con texto previo en el mensaje.
+            escaped = json.dumps(original, ensure_ascii=True)
+            unicode_at = escaped.find("\\u", len('{"message": "') + 1)
+            if unicode_at != -1 and unicode_at < escaped.index('"nextAction"'):
+                corpus.append(("truncated_unicode", escaped[:unicode_at + 4], None))
+            # Texto plano con llaves: no debe convertirse en una respuesta vacía.
+            # Se omiten los mensajes grabados que ya contienen JSON del LLM.
+            if "{" not in expected:
+                corpus.append(("plain_braces", f"Resultado: {{}}. {expected}", _PLAIN))
+                corpus.append(("plain_open_brace", f"{expected} puedo analizar {{", _PLAIN))
+                corpus.append(("plain_then_truncated", f"{expected}\n\n{{\"message\": ", _PLAIN))
+    return corpus
+
+
+def _recovered(parsed, expected):
+    if expected is _PLAIN:
+        return parsed is None
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("message"), str):
+        return False
+    if expected is None:
+        return bool(parsed["message"])
+    return parsed["message"] == expected
+
+
+def _evaluate(parse, corpus, iterations):
+    per_kind = {}
+    for kind, content, expected in corpus:
+        ok, total = per_kind.get(kind, (0, 0))
+        per_kind[kind] = (ok + int(_recovered(parse(content), expected)), total + 1)
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        for _, content, _ in corpus:
+            parse(content)
+    elapsed = time.perf_counter() - started_at
+    return per_kind, (iterations * len(corpus)) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tasa de recuperación y throughput del extractor JSON sobre el corpus de transcripts")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    corpus = build_corpus()
+    if not corpus:
+        print("No se encontraron transcripts CleanMate_Chat_*.json")
+        return 1
+    ok = 0
+    for name, parse in (("stdlib", _stdlib_parse), ("extractor", extract_llm_json)):
+        per_kind, docs_per_sec = _evaluate(parse, corpus, args.iterations)
+        ok = sum(v[0] for v in per_kind.values())
+        print(f"{name} recovered={ok}/{len(corpus)} docsPerSec={docs_per_sec:.0f}")
+        for kind, (kind_ok, kind_total) in sorted(per_kind.items()):
+            print(f"  {kind}: {kind_ok}/{kind_total}")
+    if ok < len(corpus):
+        print("EXTRACTOR REGRESSION: no se recuperaron todas las variantes")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_repo_dir = os.path.dirname(_backend_dir)
+
+
+def measure_import(runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", "import backend.server"],
+            cwd=_repo_dir,
+            check=True,
+            stdout=subprocess.DEVNULL
+        )
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el tiempo de arranque en frío de backend.server")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")))
+    args = parser.parse_args()
+
+    timings = sorted(measure_import(args.runs))
+    median_ms = timings[len(timings) // 2]
+    print(f"STARTUP runs={args.runs} minMs={timings[0]:.1f} medianMs={median_ms:.1f} maxMs={timings[-1]:.1f} budgetMs={args.budget_ms:.0f}")
+    if median_ms > args.budget_ms:
+        print("STARTUP BUDGET EXCEEDED")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import glob
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_repo_dir = os.path.dirname(_backend_dir)
+_baseline_path = os.path.join(_backend_dir, "tools", "replay_baseline.json")
+sys.path.insert(0, _backend_dir)
+
+# El replay no debe chocar con el rate limiter ni esperar turnos de admisión.
+os.environ.setdefault("CHAT_RATE_PER_MIN", "1000000")
+os.environ.setdefault("CHAT_RATE_BURST", "1000000")
+os.environ.setdefault("CHAT_IP_RATE_PER_MIN", "1000000")
+os.environ.setdefault("CHAT_IP_RATE_BURST", "1000000")
+os.environ.setdefault("GROQ_MAX_INFLIGHT", "64")
+
+import server
+from services import executed_queue, state_service
+from services.json_codec import backend_name, dumps, load
+
+_ACTION_DONE_PREFIX = "✅"
+
+
+def _use_temp_state_dir():
+    state_dir = tempfile.mkdtemp(prefix="cleanmate_replay_")
+    state_service._state_dir = state_dir
+    state_service._state_path = os.path.join(state_dir, "system_state.json")
+    state_service._history_path = os.path.join(state_dir, "history.jsonl")
+    state_service._state = None
+    state_service._history = None
+    executed_queue._journal_dir = state_dir
+    executed_queue._started_pid = None
+    executed_queue._seen_keys.clear()
+    return state_dir
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _load_json(pattern):
+    items = []
+    for path in sorted(glob.glob(os.path.join(_repo_dir, pattern))):
+        with open(path, "r", encoding="utf-8") as f:
+            items.append((os.path.basename(path), load(f)))
+    return items
+
+
+def build_sessions():
+    """Convierte cada transcript en una lista de pasos: mensajes del usuario con la salida grabada del LLM y eventos ejecutados."""
+    reports = {"analyze": None, "optimize": None}
+    for _, report in _load_json("CleanMate_Analisis_*.json"):
+        reports["analyze"] = report
+    for _, report in _load_json("CleanMate_Limpieza_*.json"):
+        reports["optimize"] = report
+    sessions = []
+    for name, transcript in _load_json("CleanMate_Chat_*.json"):
+        steps = []
+        last_suggestion = None
+        for entry in transcript:
+            message = entry.get("message") or ""
+            if entry.get("role") == "user":
+                steps.append({"kind": "message", "userMessage": message, "llm": None})
+            elif message.startswith(_ACTION_DONE_PREFIX):
+                event_type = (last_suggestion or {}).get("type")
+                if event_type in reports and reports[event_type] is not None:
+                    steps.append({"kind": "executed", "type": event_type, "report": reports[event_type]})
+            else:
+                suggestion = entry.get("actionSuggestion") or {}
+                last_suggestion = suggestion or last_suggestion
+                llm_output = dumps({
+                    "message": message,
+                    "nextAction": {
+                        "type": suggestion.get("type") or "none",
+                        "label": suggestion.get("label") or "",
+                        "autoExecute": False
+                    }
+                })
+                pending = [s for s in steps if s["kind"] == "message" and s["llm"] is None]
+                if pending:
+                    pending[-1]["llm"] = llm_output
+        for step in steps:
+            if step["kind"] == "message" and step["llm"] is None:
+                step["llm"] = dumps({"message": "", "nextAction": {"type": "none"}})
+        sessions.append((name, steps))
+    return sessions
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, elapsed_ms):
+        self.samples.setdefault(stage, []).append(elapsed_ms)
+
+    def wrap(self, module, attr, stage):
+        original = getattr(module, attr)
+
+        def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, (time.perf_counter() - started_at) * 1000)
+
+        setattr(module, attr, timed)
+        return original
+
+
+def replay(sessions, timer):
+    client = server.app.test_client()
+    fake_outputs = []
+
+    def fake_call_groq(messages, max_tokens=400, temperature=0.3, timeout=30):
+        content = fake_outputs.pop(0) if fake_outputs else ""
+        return {"choices": [{"message": {"content": content}}]}
+
+    server._call_groq = fake_call_groq
+    server.GROQ_API_KEY = "replay"
+    for _, steps in sessions:
+        started_at = time.perf_counter()
+        session_id = client.post("/api/chat/start").get_json()["sessionId"]
+        timer.record("http_chat_start", (time.perf_counter() - started_at) * 1000)
+        for step in steps:
+            started_at = time.perf_counter()
+            if step["kind"] == "message":
+                fake_outputs.append(step["llm"])
+                client.post("/api/chat/message", json={"sessionId": session_id, "userMessage": step["userMessage"], "deviceId": "replay"})
+                timer.record("http_chat_message", (time.perf_counter() - started_at) * 1000)
+            else:
+                client.post("/api/system/executed", json={"type": step["type"], "report": step["report"], "deviceId": "replay", "idempotencyKey": f"{session_id}:{started_at}"})
+                timer.record("http_system_executed", (time.perf_counter() - started_at) * 1000)
+        executed_queue.wait_idle()
+
+
+def run_once(sessions, trace_allocations=False):
+    state_dir = _use_temp_state_dir()
+    timer = StageTimer()
+    originals = [
+        (server, "_build_chat_context_and_prompt", timer.wrap(server, "_build_chat_context_and_prompt", "build_prompt")),
+        (server, "extract_llm_json", timer.wrap(server, "extract_llm_json", "extract_llm_json")),
+        (executed_queue, "apply_executed_event", timer.wrap(executed_queue, "apply_executed_event", "apply_executed_event"))
+    ]
+    if trace_allocations:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            replay(sessions, timer)
+    finally:
+        for module, attr, original in originals:
+            setattr(module, attr, original)
+    total_ms = (time.perf_counter() - started_at) * 1000
+    result = {"totalMs": total_ms, "stages": {k: statistics.median(v) for k, v in timer.samples.items()}}
+    if trace_allocations:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["allocPeakKB"] = peak / 1024
+        result["allocBlocks"] = sum(stat.count for stat in snapshot.statistics("filename"))
+    result["stateBytes"] = _dir_size(state_dir)
+    return result
+
+
+def calibrate(rounds=5):
+    """Mide un bucle fijo de Python puro: sirve de unidad para comparar tiempos entre máquinas."""
+    payload = {"cpu": 42.5, "ram": 61.0, "disk": 80.25, "processes": [{"name": f"p{i}", "ram": i * 1.5} for i in range(50)]}
+    samples = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        for _ in range(200):
+            text = dumps(payload)
+            load_items = sorted(payload["processes"], key=lambda p: -p["ram"])
+            sum(len(p["name"]) for p in load_items)
+            text.count(",")
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples)
+
+
+def _environment():
+    return {"python": platform.python_version().rsplit(".", 1)[0], "jsonBackend": backend_name()}
+
+
+def collect(runs):
+    sessions = build_sessions()
+    calibration_ms = calibrate()
+    timed = [run_once(sessions) for _ in range(runs)]
+    traced = run_once(sessions, trace_allocations=True)
+    stages = {}
+    for stage in timed[0]["stages"]:
+        stages[stage] = round(statistics.median(r["stages"].get(stage, 0) for r in timed), 3)
+    return {
+        **_environment(),
+        "sessions": len(sessions),
+        "steps": sum(len(steps) for _, steps in sessions),
+        "calibrationMs": round(calibration_ms, 3),
+        "totalMs": round(statistics.median(r["totalMs"] for r in timed), 3),
+        "stagesMedianMs": stages,
+        "stateBytes": traced["stateBytes"],
+        "allocPeakKB": round(traced["allocPeakKB"], 1),
+        "allocBlocks": traced["allocBlocks"]
+    }
+
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    """Devuelve (regresiones, avisos).
+
+    Solo fallan las métricas que no dependen de la máquina: bytes de estado
+    con el mismo backend JSON y asignaciones con la misma versión de Python.
+    Los tiempos se normalizan con el bucle de calibración y solo se avisan.
+    """
+    regressions = []
+    warnings = []
+
+    def check(target, name, now, before, min_delta=0):
+        if before and now > before * (1 + tolerance) and now - before > min_delta:
+            target.append(f"{name}: {now} > {before} (+{(now / before - 1) * 100:.0f}%)")
+
+    same_codec = current["jsonBackend"] == baseline.get("jsonBackend")
+    same_python = same_codec and current["python"] == baseline.get("python")
+    if same_codec:
+        check(regressions, "stateBytes", current["stateBytes"], baseline.get("stateBytes"))
+    if same_python:
+        check(regressions, "allocPeakKB", current["allocPeakKB"], baseline.get("allocPeakKB"))
+        check(regressions, "allocBlocks", current["allocBlocks"], baseline.get("allocBlocks"))
+    else:
+        warnings.append(
+            f"allocations not gated: python {current['python']}/{current['jsonBackend']} "
+            f"vs baseline {baseline.get('python')}/{baseline.get('jsonBackend')}"
+        )
+
+    # Los tiempos se escalan a la velocidad relativa de esta máquina; las
+    # etapas duran fracciones de ms, así que además se exige una diferencia
+    # absoluta mínima para no avisar por ruido del scheduler.
+    scale = current["calibrationMs"] / baseline["calibrationMs"] if baseline.get("calibrationMs") else 1.0
+    check(warnings, "totalMs", current["totalMs"], (baseline.get("totalMs") or 0) * scale, min_delta_ms)
+    for stage, value in current["stagesMedianMs"].items():
+        before = (baseline.get("stagesMedianMs") or {}).get(stage)
+        check(warnings, f"stage.{stage}", value, before * scale if before else None, min_delta_ms)
+    return regressions, warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce los transcripts grabados contra el backend con un LLM falso y compara con el baseline")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("REPLAY_TOLERANCE", "0.5")))
+    parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    current = collect(args.runs)
+    print(dumps(current))
+    if args.update_baseline or not os.path.isfile(_baseline_path):
+        with open(_baseline_path, "w", encoding="utf-8") as f:
+            f.write(dumps(current) + "\n")
+        print(f"BASELINE WRITTEN {_baseline_path}")
+        return 0
+    with open(_baseline_path, "r", encoding="utf-8") as f:
+        baseline = load(f)
+    regressions, warnings = compare(current, baseline, args.tolerance, args.min_delta_ms)
+    for warning in warnings:
+        print("WARNING", warning)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import state_service
+
+
+def _use_temp_state_dir():
+    state_dir = tempfile.mkdtemp(prefix="cleanmate_state_")
+    state_service._state_dir = state_dir
+    state_service._state_path = os.path.join(state_dir, "system_state.json")
+    state_service._history_path = os.path.join(state_dir, "history.jsonl")
+    state_service._state = None
+    state_service._history = None
+    return state_dir
+
+
+def run(threads, iterations):
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        barrier.wait()
+        try:
+            for i in range(iterations):
+                state_service.update_key("counter", lambda v: (v or 0) + 1)
+                state_service.update_fields({f"worker_{index}": i + 1})
+                state_service.compare_and_swap(f"cas_{index}", i, i + 1)
+                state_service.snapshot().get("counter")
+        except Exception as e:
+            errors.append(e)
+
+    started_at = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started_at
+    return elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test de actualizaciones concurrentes del estado")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    state_dir = _use_temp_state_dir()
+    state_service.update_fields({f"cas_{i}": 0 for i in range(args.threads)})
+    elapsed, errors = run(args.threads, args.iterations)
+
+    state_service._state = None
+    persisted = state_service.snapshot()
+    expected = args.threads * args.iterations
+    lost = expected - (persisted.get("counter") or 0)
+    lost += sum(args.iterations - (persisted.get(f"worker_{i}") or 0) for i in range(args.threads))
+    lost += sum(args.iterations - (persisted.get(f"cas_{i}") or 0) for i in range(args.threads))
+    print(f"STRESS threads={args.threads} iterations={args.iterations} updatesPerSec={expected * 3 / elapsed:.0f} lostUpdates={lost} errors={len(errors)} stateDir={state_dir}")
+    return 1 if lost or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
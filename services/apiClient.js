@@ -1,4 +1,6 @@
 const axios = require('axios');
+const crypto = require('crypto');
+const os = require('os');
 const log = require('electron-log');
 
 const BASE = process.env.CLEANMATE_BACKEND_URL || 'https://cleanmateai-backend.onrender.com';
@@ -9,7 +11,24 @@ const API_CHAT_MESSAGE_URL = `${BASE}/api/chat/message`;
 const API_SYSTEM_EXECUTED_URL = `${BASE}/api/system/executed`;
 const API_HEALTH_URL = `${BASE}/api/ai-health`;
 
+const EXECUTED_NOTIFY_ATTEMPTS = 3;
+const DEVICE_ID = buildDeviceId();
+
 let chatSessionId = null;
+let healthEtag = null;
+let healthData = null;
+
+// Id estable por equipo y usuario, sin datos identificables: el backend lo
+// usa para el rate limit por dispositivo y para ordenar eventos ejecutados.
+function buildDeviceId() {
+    let username = '';
+    try {
+        username = os.userInfo().username;
+    } catch (e) {
+        username = '';
+    }
+    return crypto.createHash('sha256').update(`${os.hostname()}|${username}`).digest('hex').slice(0, 32);
+}
 
 async function analyzeSystem(systemStats, cleanupStats) {
     try {
@@ -65,12 +84,16 @@ async function chatWithAI(message, context) {
 
         const payload = {
             sessionId: chatSessionId,
+            deviceId: DEVICE_ID,
             userMessage: message,
             context
         };
 
         const chatMessageStartedAt = Date.now();
-        const response = await axios.post(API_CHAT_MESSAGE_URL, payload, { timeout: 30000 });
+        const response = await axios.post(API_CHAT_MESSAGE_URL, payload, {
+            timeout: 30000,
+            headers: { 'X-Device-Id': DEVICE_ID }
+        });
         const chatMessageResponseTimeMs = Date.now() - chatMessageStartedAt;
         log.info(`Chat AI response received successfully in ${chatMessageResponseTimeMs}ms`);
         return response.data;
@@ -94,14 +117,26 @@ async function chatWithAI(message, context) {
 }
 
 async function notifySystemExecuted(type, report) {
-    try {
-        const payload = { type, report };
-        await axios.post(API_SYSTEM_EXECUTED_URL, payload, { timeout: 5000 });
-    } catch (error) {
-        log.error('System executed notify error:', error.message);
-        if (error.response) {
-            log.error('System executed response data:', error.response.data);
-            log.error('System executed status:', error.response.status);
+    // Una clave por evento, reutilizada en los reintentos: el backend solo
+    // deduplica reenvíos del mismo evento.
+    const idempotencyKey = crypto.randomUUID();
+    const payload = { type, report, idempotencyKey, deviceId: DEVICE_ID };
+    for (let attempt = 1; attempt <= EXECUTED_NOTIFY_ATTEMPTS; attempt++) {
+        try {
+            await axios.post(API_SYSTEM_EXECUTED_URL, payload, {
+                timeout: 5000,
+                headers: { 'Idempotency-Key': idempotencyKey }
+            });
+            return;
+        } catch (error) {
+            log.error(`System executed notify error (attempt ${attempt}):`, error.message);
+            if (error.response) {
+                log.error('System executed response data:', error.response.data);
+                log.error('System executed status:', error.response.status);
+                if (error.response.status < 500) {
+                    return;
+                }
+            }
         }
     }
 }
@@ -116,7 +151,18 @@ async function checkAIConnectivity() {
         lastAnalyzeError: null
     };
     try {
-        const res = await axios.get(API_HEALTH_URL, { timeout: 4000 });
+        const headers = healthEtag ? { 'If-None-Match': healthEtag } : {};
+        const res = await axios.get(API_HEALTH_URL, {
+            timeout: 4000,
+            headers,
+            validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+        });
+        if (res.status === 304 && healthData) {
+            res.data = healthData;
+        } else {
+            healthEtag = res.headers && res.headers.etag ? res.headers.etag : null;
+            healthData = res.data;
+        }
         const data = res && res.data ? res.data : {};
         const configured = !!data.gemini_configured;
         result.chat = configured;